@@ -1,28 +1,95 @@
 """Simple Telegram bot that renders received text into an image using random fonts."""
+import startup
+import asyncio
+import contextlib
 import os
+from collections import OrderedDict
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-from renderer import pick_font, render_text_image, list_fonts
-from text_transforms import available_styles, transform, generate_variants
-from translations import SUPPORTED_LANGS, get as tr_get
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackQueryHandler
-import uuid
 
+# before any project module: they read their settings from the environment at import
+load_dotenv()
 
-# Session store for /text pagination: session_id -> {variants, page, per_page, user_id}
-SESSIONS: dict[str, dict] = {}
+with startup.phase('telegram'):
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.ext import CallbackQueryHandler
+with startup.phase('styles'):
+    # renderer (Pillow, fontTools) is imported on the first /style instead
+    from text_transforms import available_styles, transform, generate_variants
+with startup.phase('modules'):
+    from translations import SUPPORTED_LANGS, get as tr_get
+    from warm_cache import load as load_warm_cache
+    from text_store import open_store as open_text_store
+    from send_queue import OutboundScheduler
+    from load_policy import LoadPolicy
+    from profiling import Profiler, PROFILE_ON_START, parse_budget
+    from callback_tokens import (PAGE_PREFIX, ACTION_PREV, ACTION_NEXT, InvalidToken,
+                                 encode as encode_token, decode as decode_token, user_hash)
+    from normalize import SingleFlight, normalize_text, text_key
+
+
+# Texts being paginated: text_key -> original text. Pages themselves are
+# rebuilt from the callback token, so this is the only pagination state;
+# it is also kept in TEXT_STORE so old buttons keep working after a restart.
+TEXTS: OrderedDict[int, str] = OrderedDict()
+TEXTS_MAX = 10000
+
+# Recently shown variant lists so page clicks don't regenerate them
+VARIANT_CACHE: OrderedDict[int, list[str]] = OrderedDict()
+VARIANT_CACHE_MAX = 256
+
+# Concurrent requests for the same text share one generate_variants run
+INFLIGHT = SingleFlight()
+
+VARIANTS_PER_TEXT = 40  # 8 pages × 5 variants per page
+PER_PAGE = 5
 
 
 # Simple in-memory user language store: user_id -> lang_code
 USER_LANG: dict[int, str] = {}
 
 
-load_dotenv()
+TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 
+# Telegram user ids allowed to run admin commands (comma separated)
+ADMIN_IDS = {int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip().isdigit()}
 
-TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
+
+# Precomputed variants for hot texts, built offline by warm_cache.py
+with startup.phase('warm_cache'):
+    WARM_CACHE = load_warm_cache()
+    TEXT_STORE = open_text_store()
+
+
+# All outgoing messages go through one scheduler to stay under flood limits
+OUTBOX = OutboundScheduler()
+
+# Switches variant/render work to cheaper modes while the bot is saturated
+POLICY = LoadPolicy()
+
+# Off until started by /profile or PROFILE_ON_START
+PROFILER = Profiler()
+
+
+async def reply_text(update: Update, text: str, **kwargs):
+    return await OUTBOX.submit(update.effective_chat.id, lambda: update.message.reply_text(text, **kwargs))
+
+
+async def reply_photo(update: Update, photo):
+    async def send():
+        # rewind in case this is a retry after flood control
+        photo.seek(0)
+        return await update.message.reply_photo(photo)
+    return await OUTBOX.submit(update.effective_chat.id, send)
+
+
+async def edit_text(query, text: str, **kwargs):
+    # repeated edits of one message collapse into the latest state
+    message = query.message
+    chat_id = message.chat_id if message else None
+    key = ('edit', chat_id, message.message_id) if message else None
+    return await OUTBOX.submit(chat_id, lambda: query.edit_message_text(text, **kwargs), coalesce_key=key)
 
 
 async def check_subscription(user_id: int, bot) -> bool:
@@ -47,7 +114,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if row:
         buttons.append(row)
     keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(choose_text, reply_markup=keyboard)
+    await reply_text(update, choose_text, reply_markup=keyboard)
 
 
 
@@ -55,27 +122,33 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def styles_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     styles = available_styles()
-    await update.message.reply_text('Доступные стили:\n' + ', '.join(styles))
+    await reply_text(update, 'Доступные стили:\n' + ', '.join(styles))
 
 
+@PROFILER.profiled
 async def style_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # /style <style> <text>
     args = context.args
     if not args or len(args) < 2:
-        await update.message.reply_text('Использование: /style <style> <текст>')
+        await reply_text(update, 'Использование: /style <style> <текст>')
         return
     style = args[0]
-    text = ' '.join(args[1:])
+    text = normalize_text(' '.join(args[1:]))
     try:
-        t = transform(text, style)
+        t = WARM_CACHE.styled(text, style) or transform(text, style)
     except KeyError:
         user_id = update.effective_user.id
         lang = USER_LANG.get(user_id, 'en')
-        await update.message.reply_text('Неизвестный стиль. Используйте /styles чтобы увидеть список')
+        await reply_text(update, 'Неизвестный стиль. Используйте /styles чтобы увидеть список')
         return
-    font = pick_font(size=72)
-    img = render_text_image(t, font, size=64)
-    await update.message.reply_photo(img)
+    from renderer import pick_font, render_text_image
+    settings = POLICY.settings()
+    with POLICY.track():
+        font = pick_font(size=72, text=t)
+        img = render_text_image(t, font, size=settings['render_size'], smooth_chance=settings['smooth_chance'],
+                                compress_level=settings['compress_level'])
+    # once queued in OUTBOX the send is counted by its depth, not as in flight
+    await reply_photo(update, img)
 
 
 async def callback_set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -87,7 +160,7 @@ async def callback_set_language(update: Update, context: ContextTypes.DEFAULT_TY
     
     code = data.split(':', 1)[1]
     if code not in SUPPORTED_LANGS:
-        await query.edit_message_text('Unsupported language')
+        await edit_text(query, 'Unsupported language')
         return
     
     user_id = update.effective_user.id
@@ -100,7 +173,7 @@ async def callback_set_language(update: Update, context: ContextTypes.DEFAULT_TY
         buttons = [[InlineKeyboardButton(tr_get(code, 'check_subscription'), 
                                        callback_data=f'check_sub:{code}')]]
         keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(
+        await edit_text(query,
             tr_get(code, 'subscription_required'),
             reply_markup=keyboard
         )
@@ -108,46 +181,35 @@ async def callback_set_language(update: Update, context: ContextTypes.DEFAULT_TY
     
     # If subscribed, show welcome message
     welcome = tr_get(code, 'welcome')
-    await query.edit_message_text(welcome)
+    await edit_text(query, welcome)
 
 
-async def callback_session_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data or ''
-    if ':' not in data:
-        return
-    session_id, action = data.split(':', 1)
-    sess = SESSIONS.get(session_id)
-    if not sess:
-        await query.edit_message_text('Session expired or not found')
-        return
-    if update.effective_user.id != sess.get('user_id'):
-        await query.answer('This session is not yours', show_alert=True)
-        return
-        
-    # Fixed number of items per page and total pages
-    per = 5  # 5 variants per page
-    total = len(sess['variants'])
-    pages = 8  # Always maintain 8 pages
-    if action == 'next':
-        sess['page'] = (sess.get('page', 0) + 1) % pages
-    elif action == 'prev':
-        sess['page'] = (sess.get('page', 0) - 1) % pages
-    page = sess.get('page', 0)
-    
-    # Calculate start and end indices ensuring we have variants for all pages
-    start = page * per
-    end = start + per
-    
-    # If we're beyond our variants, generate more
-    while len(sess['variants']) < end:
-        # Add more variants using combining characters or other transformations
-        base_text = sess['original_text']
-        new_variant = ''.join(c + chr(0x0300 + random.randint(0, 0x6F)) for c in base_text)
-        sess['variants'].append(new_variant)
-    
-    chunk = sess['variants'][start:end]
+def _remember(cache: OrderedDict, key, value, limit: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+async def get_variants(text: str, key: int) -> list[str]:
+    variants = VARIANT_CACHE.get(key) or WARM_CACHE.variants(text)
+    if variants is None:
+        figlet = POLICY.settings()['figlet']
+        # seeded by the text key, so a rebuilt list matches the one first shown;
+        # runs off the event loop since figlet rendering is slow
+        variants = await INFLIGHT.run((key, figlet), PROFILER.to_thread, generate_variants,
+                                      text, VARIANTS_PER_TEXT, key, figlet)
+        if not figlet:
+            # don't let a degraded list outlive the load spike
+            return variants
+    _remember(VARIANT_CACHE, key, variants, VARIANT_CACHE_MAX)
+    return variants
+
+
+def page_view(user_id: int, key: int, variants: list[str], page: int):
+    pages = max(1, (len(variants) + PER_PAGE - 1) // PER_PAGE)
+    page %= pages
+    chunk = variants[page * PER_PAGE:(page + 1) * PER_PAGE]
 
     # Just show page number in text, variants will be clickable buttons
     text = f"Page {page+1}/{pages}"
@@ -161,22 +223,62 @@ async def callback_session_nav(update: Update, context: ContextTypes.DEFAULT_TYP
         kb.append([InlineKeyboardButton(visible, switch_inline_query_current_chat=v)])
     left = '⬅️'
     right = '➡️'
-    kb.append([InlineKeyboardButton(left, callback_data=f'{session_id}:prev'), InlineKeyboardButton(right, callback_data=f'{session_id}:next')])
-    keyboard = InlineKeyboardMarkup(kb)
-    await query.edit_message_text(text, reply_markup=keyboard)
+    kb.append([InlineKeyboardButton(left, callback_data=encode_token(user_id, key, page, ACTION_PREV)),
+               InlineKeyboardButton(right, callback_data=encode_token(user_id, key, page, ACTION_NEXT))])
+    return text, InlineKeyboardMarkup(kb)
+
+
+async def send_variants(update: Update, text: str):
+    with POLICY.track():
+        key = text_key(text)
+        variants = await get_variants(text, key)
+    if not variants:
+        await reply_text(update, 'No variants generated')
+        return
+    if key not in TEXTS:
+        TEXT_STORE.put(key, text)
+    _remember(TEXTS, key, text, TEXTS_MAX)
+    text_msg, keyboard = page_view(update.effective_user.id, key, variants, 0)
+    await reply_text(update, text_msg, reply_markup=keyboard)
 
 
+@PROFILER.profiled
+async def callback_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    try:
+        token = decode_token(query.data or '')
+    except InvalidToken:
+        await query.answer()
+        return
+    user_id = update.effective_user.id
+    if token.user_hash != user_hash(user_id):
+        await query.answer('This session is not yours', show_alert=True)
+        return
+    await query.answer()
+    # after a restart TEXTS is empty; fall back to the persisted texts
+    key = token.text_key
+    text = TEXTS.get(key) or WARM_CACHE.text_for_key(key) or TEXT_STORE.get(key)
+    if text is None:
+        await edit_text(query, 'Session expired or not found')
+        return
+    _remember(TEXTS, key, text, TEXTS_MAX)
+    with POLICY.track():
+        variants = await get_variants(text, key)
+    page = token.page
+    if token.action == ACTION_NEXT:
+        page += 1
+    elif token.action == ACTION_PREV:
+        page -= 1
+    text_msg, keyboard = page_view(user_id, key, variants, page)
+    await edit_text(query, text_msg, reply_markup=keyboard)
+
+
+@PROFILER.profiled
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (update.message.text or '').strip()
+    text = normalize_text(update.message.text or '')
     if not text:
         return
-        
-    # Detect text language
-    has_cyrillic = any(ord('а') <= ord(c) <= ord('я') or ord('А') <= ord(c) <= ord('Я') for c in text)
-    
-    # Generate more variants to fill 8 pages with 5 variants each (40 total)
-    max_variants = 40  # 8 pages × 5 variants per page
-    
+
     # Check subscription first
     user_id = update.effective_user.id
     is_subscribed = await check_subscription(user_id, context.bot)
@@ -185,55 +287,26 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = [[InlineKeyboardButton(tr_get(code, 'check_subscription'), 
                                        callback_data=f'check_sub:{code}')]]
         keyboard = InlineKeyboardMarkup(buttons)
-        await update.message.reply_text(
+        await reply_text(update,
             tr_get(code, 'subscription_required'),
             reply_markup=keyboard
         )
         return
         
     # Generate variants for 8 pages with 5 variants each
-    variants = generate_variants(text, max_variants=max_variants)
-    if not variants:
-        await update.message.reply_text('No variants generated')
-        return
-    session_id = str(uuid.uuid4())
-    SESSIONS[session_id] = {'variants': variants, 'page': 0, 'per_page': 5, 'user_id': update.effective_user.id}
-    # show first page
-    per = 5
-    total = len(variants)
-    pages = (total + per - 1) // per
-    chunk = variants[0:per]
-    # Instead of a message with a preview + copy button, we'll just show the variants as buttons
-    text_msg = f"Page 1/{pages}"
-    kb = []
-    for v in chunk:
-        # Use the variant text itself as the button label
-        # Limit the visible text to keep buttons reasonable
-        visible = v[:30]  # Show first 30 chars in button
-        kb.append([InlineKeyboardButton(visible, switch_inline_query_current_chat=v)])
-    left = '⬅️'
-    right = '➡️'
-    kb.append([InlineKeyboardButton(left, callback_data=f'{session_id}:prev'), InlineKeyboardButton(right, callback_data=f'{session_id}:next')])
-    keyboard = InlineKeyboardMarkup(kb)
-    await update.message.reply_text(text_msg, reply_markup=keyboard)
+    await send_variants(update, text)
 
 
+@PROFILER.profiled
 async def text_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
     if not args:
-        await update.message.reply_text('Использование: /text <текст>')
+        await reply_text(update, 'Использование: /text <текст>')
         return
-    text = ' '.join(args)
-    variants = generate_variants(text, max_variants=50)
-    if not variants:
-        await update.message.reply_text('No variants generated')
+    text = normalize_text(' '.join(args))
+    if not text:
         return
-    session_id = str(uuid.uuid4())
-    SESSIONS[session_id] = {'variants': variants, 'index': 0, 'user_id': update.effective_user.id}
-    left = '⬅️'
-    right = '➡️'
-    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(left, callback_data=f'{session_id}:prev'), InlineKeyboardButton(right, callback_data=f'{session_id}:next')]])
-    await update.message.reply_text(f"1/{len(variants)}\n{variants[0]}", reply_markup=keyboard)
+    await send_variants(update, text)
 
 
 async def callback_check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -250,33 +323,98 @@ async def callback_check_subscription(update: Update, context: ContextTypes.DEFA
     if is_subscribed:
         # Show welcome message if now subscribed
         welcome = tr_get(code, 'welcome')
-        await query.edit_message_text(welcome)
+        await edit_text(query, welcome)
     else:
         # Show subscription requirement message again
         buttons = [[InlineKeyboardButton(tr_get(code, 'check_subscription'), 
                                        callback_data=f'check_sub:{code}')]]
         keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(
+        await edit_text(query,
             tr_get(code, 'subscription_required'),
             reply_markup=keyboard
         )
 
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /profile <N|Ns|stop> - profile the next N requests or N seconds (admins only)
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    args = context.args
+    if args and args[0] == 'stop':
+        if PROFILER.stop() is None:
+            await reply_text(update, 'Profiler is not running')
+        return
+    try:
+        requests, seconds = parse_budget(args[0] if args else '50')
+    except ValueError:
+        await reply_text(update, 'Использование: /profile <N|Ns|stop>')
+        return
+    chat_id = update.effective_chat.id
+
+    def on_done(summary: str):
+        # Telegram messages are capped at 4096 characters
+        context.application.create_task(
+            OUTBOX.submit(chat_id, lambda: context.bot.send_message(chat_id, summary[:4000])))
+
+    if not PROFILER.start(requests, seconds, on_done):
+        await reply_text(update, 'Profiler is already running')
+        return
+    budget = f'{requests} requests' if requests else f'{seconds:g}s'
+    await reply_text(update, f'Profiling the next {budget}')
+
+
+# callback_data is routed by its first character
+CALLBACK_ROUTES = {
+    's': callback_set_language,        # setlang:<code>
+    'c': callback_check_subscription,  # check_sub:<code>
+    PAGE_PREFIX: callback_page,        # signed page token
+}
+
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    data = update.callback_query.data or ''
+    handler = CALLBACK_ROUTES.get(data[:1])
+    if handler is None:
+        await update.callback_query.answer()
+        return
+    await handler(update, context)
+
+
+# Load monitor task; started in _post_init, cancelled in _shutdown
+MONITOR_TASK = None
+
+
+async def _post_init(app):
+    global MONITOR_TASK
+    # not app.create_task: the application isn't running yet and wouldn't await it
+    MONITOR_TASK = asyncio.create_task(POLICY.monitor(OUTBOX.depth))
+    if PROFILE_ON_START:
+        PROFILER.start(*parse_budget(PROFILE_ON_START), on_done=print)
+
+
+async def _shutdown(app):
+    if MONITOR_TASK is not None:
+        MONITOR_TASK.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await MONITOR_TASK
+    await OUTBOX.close()
+    TEXT_STORE.close()
+
+
 def main():
     token = TELEGRAM_TOKEN
     if not token:
         raise RuntimeError('Set TELEGRAM_TOKEN in .env')
-    app = ApplicationBuilder().token(token).build()
+    with startup.phase('app'):
+        app = ApplicationBuilder().token(token).concurrent_updates(True).post_init(_post_init).post_shutdown(_shutdown).build()
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('styles', styles_cmd))
     app.add_handler(CommandHandler('style', style_cmd))
     app.add_handler(CommandHandler('text', text_cmd))
-    # callback for language selection (setlang:code)
-    app.add_handler(CallbackQueryHandler(callback_set_language, pattern=r'^setlang:'))
-    # callback for subscription check
-    app.add_handler(CallbackQueryHandler(callback_check_subscription, pattern=r'^check_sub:'))
-    # callback for session navigation (sessionid:prev|next)
-    app.add_handler(CallbackQueryHandler(callback_session_nav, pattern=r'^[0-9a-fA-F\-]+:(prev|next)$'))
+    app.add_handler(CommandHandler('profile', profile_cmd))
+    # all inline button callbacks, dispatched by CALLBACK_ROUTES
+    app.add_handler(CallbackQueryHandler(route_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    print(startup.report())
     print('Bot started')
     app.run_polling()
 
@@ -0,0 +1,83 @@
+"""Compact signed callback_data tokens for variant pagination.
+
+A token is PAGE_PREFIX followed by unpadded urlsafe base64 of
+
+    user hash (4 bytes) | text key (8 bytes) | page (1) | action (1) | HMAC (8)
+
+31 characters in total, well within Telegram's 64-byte callback_data limit.
+The text key (normalize.text_key) doubles as the variant generation seed, so
+a page can be rebuilt from the token plus the original text without any
+per-session state.
+The first character of callback_data selects the handler (see bot.CALLBACK_ROUTES).
+"""
+from __future__ import annotations
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from typing import NamedTuple, Optional
+
+
+PAGE_PREFIX = '~'
+
+ACTION_SHOW = 0
+ACTION_PREV = 1
+ACTION_NEXT = 2
+
+_LAYOUT = struct.Struct('>IQBB')
+_MAC_SIZE = 8
+
+_secret: Optional[bytes] = None
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class PageToken(NamedTuple):
+    user_hash: int
+    text_key: int
+    page: int
+    action: int
+
+
+def _get_secret() -> bytes:
+    # read lazily: bot.py loads .env after importing this module
+    global _secret
+    if _secret is None:
+        raw = os.environ.get('CALLBACK_SECRET') or os.environ.get('TELEGRAM_TOKEN')
+        _secret = hashlib.sha256(raw.encode('utf-8')).digest() if raw else os.urandom(32)
+    return _secret
+
+
+def _mac(payload: bytes) -> bytes:
+    return hmac.new(_get_secret(), payload, hashlib.sha256).digest()[:_MAC_SIZE]
+
+
+def user_hash(user_id: int) -> int:
+    digest = hashlib.blake2b(str(user_id).encode('ascii'), digest_size=4).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def encode(user_id: int, key: int, page: int, action: int = ACTION_SHOW) -> str:
+    payload = _LAYOUT.pack(user_hash(user_id), key, page % 256, action)
+    raw = payload + _mac(payload)
+    return PAGE_PREFIX + base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode(data: str) -> PageToken:
+    """Parse and verify a token. Raises InvalidToken on anything malformed or forged."""
+    if not data.startswith(PAGE_PREFIX):
+        raise InvalidToken('not a page token')
+    body = data[len(PAGE_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))
+    except (ValueError, TypeError):
+        raise InvalidToken('bad encoding')
+    if len(raw) != _LAYOUT.size + _MAC_SIZE:
+        raise InvalidToken('bad length')
+    payload, mac = raw[:_LAYOUT.size], raw[_LAYOUT.size:]
+    if not hmac.compare_digest(mac, _mac(payload)):
+        raise InvalidToken('bad signature')
+    return PageToken(*_LAYOUT.unpack(payload))
@@ -0,0 +1,120 @@
+"""Load-aware quality policy for the variant and render paths.
+
+The policy watches event-loop lag and the number of queued/in-flight requests
+and picks one of three modes:
+
+* full    - everything on (figlet variants, smoothing filter, full-size PNGs)
+* reduced - no figlet, no filter, smaller renders, fast PNG compression
+* minimal - as reduced, with the smallest renders and no PNG compression
+
+Pressure switches to a cheaper mode immediately. Recovery steps back one mode
+at a time, and only after load has stayed low for `cooldown` seconds.
+`observe()` takes the measurements and the clock is injectable, so a
+simulated load trace gives the same mode sequence every time.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+
+FULL = 'full'
+REDUCED = 'reduced'
+MINIMAL = 'minimal'
+MODES = (FULL, REDUCED, MINIMAL)
+
+MODE_SETTINGS: Dict[str, dict] = {
+    FULL: {'figlet': True, 'smooth_chance': 0.25, 'render_size': 64, 'compress_level': 6},
+    REDUCED: {'figlet': False, 'smooth_chance': 0.0, 'render_size': 48, 'compress_level': 1},
+    MINIMAL: {'figlet': False, 'smooth_chance': 0.0, 'render_size': 36, 'compress_level': 0},
+}
+
+# (reduced, minimal) thresholds
+LAG_THRESHOLDS = (float(os.environ.get('LOAD_LAG_REDUCED', '0.05')),
+                  float(os.environ.get('LOAD_LAG_MINIMAL', '0.25')))
+DEPTH_THRESHOLDS = (int(os.environ.get('LOAD_DEPTH_REDUCED', '50')),
+                    int(os.environ.get('LOAD_DEPTH_MINIMAL', '200')))
+COOLDOWN = float(os.environ.get('LOAD_COOLDOWN', '15'))
+MONITOR_INTERVAL = float(os.environ.get('LOAD_MONITOR_INTERVAL', '0.5'))
+
+
+class LoadPolicy:
+    def __init__(self, lag_thresholds: tuple[float, float] = LAG_THRESHOLDS,
+                 depth_thresholds: tuple[int, int] = DEPTH_THRESHOLDS,
+                 cooldown: float = COOLDOWN, clock: Callable[[], float] = time.monotonic):
+        self.lag_thresholds = lag_thresholds
+        self.depth_thresholds = depth_thresholds
+        self.cooldown = cooldown
+        self.clock = clock
+        self.mode = FULL
+        self.lag = 0.0
+        self.depth = 0
+        self.inflight = 0
+        # 'full->reduced' -> count
+        self.switches: Dict[str, int] = {}
+        self._calm_since: Optional[float] = None
+
+    def _level(self, lag: float, depth: int) -> int:
+        level = 0
+        for i, (lag_limit, depth_limit) in enumerate(zip(self.lag_thresholds, self.depth_thresholds)):
+            if lag >= lag_limit or depth >= depth_limit:
+                level = i + 1
+        return level
+
+    def _switch(self, mode: str):
+        key = f'{self.mode}->{mode}'
+        self.switches[key] = self.switches.get(key, 0) + 1
+        print(f'Load policy: {key} (lag {self.lag * 1000:.0f} ms, depth {self.depth})')
+        self.mode = mode
+
+    def observe(self, lag: float, depth: int) -> str:
+        """Feed one measurement; returns the mode now in effect."""
+        self.lag = lag
+        self.depth = depth
+        target = self._level(lag, depth)
+        current = MODES.index(self.mode)
+        now = self.clock()
+        if target > current:
+            self._switch(MODES[target])
+            self._calm_since = None
+        elif target < current:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cooldown:
+                self._switch(MODES[current - 1])
+                # the next step down needs its own quiet period
+                self._calm_since = now
+        else:
+            self._calm_since = None
+        return self.mode
+
+    def settings(self) -> dict:
+        return MODE_SETTINGS[self.mode]
+
+    def metrics(self) -> dict:
+        return {'mode': self.mode, 'lag_ms': round(self.lag * 1000, 1), 'depth': self.depth,
+                'inflight': self.inflight, 'switches': dict(self.switches)}
+
+    @contextmanager
+    def track(self):
+        """Count a request as in flight for the duration of the block.
+
+        End the block before handing the reply to the send queue: queued
+        sends are already counted by `queue_depth` in monitor().
+        """
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    async def monitor(self, queue_depth: Callable[[], int] = lambda: 0, interval: float = MONITOR_INTERVAL):
+        """Sample loop lag every `interval` seconds, forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.observe(lag, self.inflight + queue_depth())
@@ -0,0 +1,113 @@
+"""Input normalization and request deduplication ahead of variant generation.
+
+`normalize_text` turns whatever the user pasted into the canonical form every
+later stage sees: NFC, invisible format characters removed, whitespace
+collapsed and the length capped at MAX_TEXT_LEN. `text_key` hashes that form
+into the stable 64-bit key shared by the warm cache, the variant cache and the
+callback tokens (where it is also the variant seed).
+
+Case is kept as sent: 'alex' and 'Alex' produce different styled output, so
+they are different requests.
+
+`SingleFlight` collapses concurrent identical computations so that N users
+sending the same text at once cost one generate_variants run.
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import hashlib
+import os
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+# Buttons only show the first 30 characters, so longer pastes are cut here
+MAX_TEXT_LEN = int(os.environ.get('MAX_TEXT_LEN', '100'))
+
+# Invisible characters that carry meaning inside emoji sequences only
+_ZWJ = '\u200d'
+_VARIATION_SELECTORS = '\ufe0e\ufe0f'
+_KEYCAP = '\u20e3'
+_BLACK_FLAG = '\U0001F3F4'
+# combining grapheme joiner: never changes how text looks
+_CGJ = '\u034f'
+
+
+def _is_tag(ch: str) -> bool:
+    # tag characters spell subdivision flags after a black flag, e.g. England
+    return '\U000E0020' <= ch <= '\U000E007F'
+
+
+def _is_pictographic(ch: str) -> bool:
+    # symbols, dingbats and the emoji blocks (incl. skin tones and regional indicators)
+    return (unicodedata.category(ch) == 'So' or '\u2600' <= ch <= '\u27bf'
+            or '\U0001F000' <= ch <= '\U0001FAFF')
+
+
+def _strip_invisible(text: str) -> str:
+    out: list[str] = []
+    for i, ch in enumerate(text):
+        nxt = text[i + 1] if i + 1 < len(text) else ''
+        if ch in _VARIATION_SELECTORS:
+            # emoji/text presentation after a symbol, or a keycap like 1️⃣
+            if out and (_is_pictographic(out[-1]) or nxt == _KEYCAP):
+                out.append(ch)
+        elif ch == _ZWJ:
+            # keep a joiner only between two emoji
+            if out and (_is_pictographic(out[-1]) or out[-1] in _VARIATION_SELECTORS) \
+                    and nxt and _is_pictographic(nxt):
+                out.append(ch)
+        elif ch == _CGJ:
+            continue
+        elif unicodedata.category(ch) != 'Cf':
+            out.append(ch)
+        elif _is_tag(ch) and out and (out[-1] == _BLACK_FLAG or _is_tag(out[-1])):
+            out.append(ch)
+    return ''.join(out)
+
+
+def normalize_text(text: str, max_len: int = MAX_TEXT_LEN) -> str:
+    text = unicodedata.normalize('NFC', text)
+    text = _strip_invisible(text)
+    text = ' '.join(text.split())
+    if len(text) > max_len:
+        # don't leave a dangling joiner at the cut
+        text = text[:max_len].rstrip().rstrip(_ZWJ).rstrip()
+    return text
+
+
+def text_key(text: str) -> int:
+    """Stable 64-bit key for an already normalized `text`."""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class SingleFlight:
+    """Run at most one computation per key at a time; later callers share its result."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {'runs': 0, 'shared': 0}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['shared'] += 1
+        else:
+            # its own task, so no single caller owns the run
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            self.stats['runs'] += 1
+            task.add_done_callback(functools.partial(self._done, key))
+        # shield: a caller giving up must not cancel the run for the others
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # mark retrieved so a run whose callers all left doesn't log a warning
+            task.exception()
@@ -0,0 +1,171 @@
+"""On-demand profiling for bot handlers.
+
+`Profiler.start()` turns on cProfile and tracemalloc for the next N handler
+calls and/or T seconds. When the budget runs out, the aggregated stats and
+the memory snapshot are written to PROFILE_DIR, and a short top-functions
+summary is handed to the `on_done` callback.
+
+Handlers are wrapped with `PROFILER.profiled`. While profiling is off the
+wrapper only checks one attribute, so it is always safe to leave in place.
+cProfile only sees the thread that enabled it, so work handed to a thread
+goes through `PROFILER.to_thread`, which profiles it there and merges the
+stats into the same report.
+
+It is started with the admin /profile command (see bot.py) or at launch with
+PROFILE_ON_START, e.g. PROFILE_ON_START=50 (requests) or PROFILE_ON_START=30s.
+"""
+from __future__ import annotations
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_ON_START = os.environ.get('PROFILE_ON_START', '')
+
+TOP_FUNCTIONS = 10
+TOP_ALLOCATIONS = 5
+
+
+def parse_budget(spec: str) -> tuple[Optional[int], Optional[float]]:
+    """Parse '50' (requests) or '30s' (seconds). Raises ValueError otherwise."""
+    spec = spec.strip().lower()
+    if spec.endswith('s'):
+        seconds = float(spec[:-1])
+        if seconds <= 0:
+            raise ValueError(spec)
+        return None, seconds
+    requests = int(spec)
+    if requests <= 0:
+        raise ValueError(spec)
+    return requests, None
+
+
+def _short_path(filename: str) -> str:
+    # keep the package name so 'pyfiglet/__init__.py' is not just '__init__.py'
+    parts = filename.replace(os.sep, '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+class Profiler:
+    def __init__(self, out_dir: str = PROFILE_DIR):
+        self.out_dir = out_dir
+        self.active = False
+        self.requests = 0
+        self._profile: Optional[cProfile.Profile] = None
+        # profiles of worker-thread calls, merged into the report by _write
+        self._thread_profiles: list[cProfile.Profile] = []
+        self._remaining: Optional[int] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_done: Optional[Callable[[str], None]] = None
+        self._started = 0.0
+
+    def start(self, requests: Optional[int] = None, seconds: Optional[float] = None,
+              on_done: Optional[Callable[[str], None]] = None) -> bool:
+        """Profile the next `requests` calls and/or `seconds`. False if already running."""
+        if self.active:
+            return False
+        self.requests = 0
+        self._remaining = requests
+        self._on_done = on_done
+        self._started = time.monotonic()
+        if seconds is not None:
+            self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        self._thread_profiles = []
+        tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.active = True
+        return True
+
+    def profiled(self, fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not self.active:
+                return await fn(*args, **kwargs)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self._count()
+        return wrapper
+
+    async def to_thread(self, fn, *args):
+        """asyncio.to_thread that is visible to the profiler while it runs."""
+        if not self.active:
+            return await asyncio.to_thread(fn, *args)
+        profiles = self._thread_profiles
+
+        def target():
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler already owns this interpreter
+                return fn(*args)
+            try:
+                return fn(*args)
+            finally:
+                profile.disable()
+                profiles.append(profile)
+        return await asyncio.to_thread(target)
+
+    def _count(self):
+        if not self.active:
+            return
+        self.requests += 1
+        if self._remaining is not None:
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self.stop()
+
+    def stop(self) -> Optional[str]:
+        """Stop profiling, write the results and return the summary."""
+        if not self.active:
+            return None
+        self.active = False
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        summary = self._write(self._profile, snapshot)
+        self._profile = None
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(summary)
+        return summary
+
+    def _write(self, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot) -> str:
+        elapsed = time.monotonic() - self._started
+        stats = pstats.Stats(profile)
+        for thread_profile in self._thread_profiles:
+            stats.add(thread_profile)
+        self._thread_profiles = []
+        lines = [f'Profiled {self.requests} requests over {elapsed:.1f}s', 'Top functions (self time):']
+        top = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+        for (filename, lineno, func), (_cc, calls, tottime, cumtime, _callers) in top:
+            where = f'{_short_path(filename)}:{lineno}' if lineno else filename
+            lines.append(f'  {tottime * 1000:8.1f} ms {cumtime * 1000:8.1f} ms cum {calls:6d}x  {func} ({where})')
+        lines.append('Top allocations:')
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            lines.append(f'  {stat.size / 1024:8.1f} KiB {stat.count:6d} blocks  '
+                         f'{_short_path(frame.filename)}:{frame.lineno}')
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            base = os.path.join(self.out_dir, stamp)
+            stats.dump_stats(base + '.pstats')
+            snapshot.dump(base + '.tracemalloc')
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            lines.append(f'Saved to {base}.*')
+        except OSError as exc:
+            lines.append(f'Could not save results: {exc}')
+        return '\n'.join(lines)
@@ -1,13 +1,34 @@
 from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache
 from io import BytesIO
+import json
 import os
 import random
-from typing import Tuple
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import unicodedata
+from typing import Dict, Tuple
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageFilter
 
 
 FONTS_DIR = os.environ.get('FONTS_DIR', 'fonts')
 
+# Coverage index cache; entries are reused while a font's size and mtime match
+COVERAGE_SNAPSHOT = os.environ.get('COVERAGE_SNAPSHOT', os.path.join(FONTS_DIR, '.coverage_index.json'))
+_SNAPSHOT_FORMAT = 1
+
+# font path -> codepoints present in the font's cmap
+_font_coverage: Dict[str, frozenset[int]] = {}
+# fonts whose cmap could not be read; kept out of the snapshot so they are retried
+_unreadable: set[str] = set()
+_snapshot_loaded = False
+
+# Glyph atlas: (font_path, size, cluster) -> (mask, left, top, advance).
+# Each glyph is rasterized once; the shadow and fill passes reuse its mask.
+# Least recently used glyphs are evicted above GLYPH_CACHE_BYTES of masks.
+GLYPH_CACHE_BYTES = int(os.environ.get('GLYPH_CACHE_BYTES', str(32 * 1024 * 1024)))
+_glyphs: OrderedDict[tuple, tuple] = OrderedDict()
+_glyph_bytes = 0
+
 
 def list_fonts() -> list[str]:
     if not os.path.isdir(FONTS_DIR):
@@ -15,70 +36,276 @@ def list_fonts() -> list[str]:
     return [os.path.join(FONTS_DIR, f) for f in os.listdir(FONTS_DIR) if f.lower().endswith(('.ttf', '.otf'))]
 
 
+def _read_cmap(font_path: str) -> frozenset[int]:
+    try:
+        # fontTools is only needed when the snapshot is missing or stale
+        from fontTools.ttLib import TTFont
+        font = TTFont(font_path, lazy=True)
+        try:
+            cmap = font.getBestCmap() or {}
+        finally:
+            font.close()
+    except Exception:
+        _unreadable.add(font_path)
+        return frozenset()
+    _unreadable.discard(font_path)
+    return frozenset(cmap)
+
+
+def _to_ranges(codepoints: frozenset[int]) -> list[list[int]]:
+    ranges = []
+    for cp in sorted(codepoints):
+        if ranges and ranges[-1][1] == cp - 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return ranges
+
+
+def _from_ranges(ranges: list[list[int]]) -> frozenset[int]:
+    return frozenset(cp for start, end in ranges for cp in range(start, end + 1))
+
+
+def _font_stamp(path: str) -> list[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _load_coverage_snapshot() -> Dict[str, list]:
+    try:
+        with open(COVERAGE_SNAPSHOT, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('format') != _SNAPSHOT_FORMAT:
+        return {}
+    return data.get('fonts', {})
+
+
+def _save_coverage_snapshot(stamps: Dict[str, list[int]]):
+    fonts = {os.path.basename(path): [*stamps[path], _to_ranges(cov)]
+             for path, cov in _font_coverage.items() if path in stamps and path not in _unreadable}
+    tmp = COVERAGE_SNAPSHOT + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'format': _SNAPSHOT_FORMAT, 'fonts': fonts}, f)
+        os.replace(tmp, COVERAGE_SNAPSHOT)
+    except OSError:
+        pass
+
+
+def coverage_index() -> Dict[str, frozenset[int]]:
+    """Return font path -> covered codepoints for every font in FONTS_DIR.
+
+    The first call loads the on-disk snapshot and only parses fonts that are
+    new or changed since it was written; the index then lives for the process.
+    """
+    global _snapshot_loaded
+    if not _snapshot_loaded:
+        _snapshot_loaded = True
+        snapshot = _load_coverage_snapshot()
+        stamps = {}
+        changed = False
+        for path in list_fonts():
+            try:
+                stamps[path] = _font_stamp(path)
+            except OSError:
+                continue
+            entry = snapshot.get(os.path.basename(path))
+            if entry and entry[:2] == stamps[path]:
+                _font_coverage[path] = _from_ranges(entry[2])
+            else:
+                _font_coverage[path] = _read_cmap(path)
+                changed = True
+        if changed or len(snapshot) != len(stamps) - len(_unreadable):
+            _save_coverage_snapshot(stamps)
+    for path in list_fonts():
+        if path not in _font_coverage:
+            _font_coverage[path] = _read_cmap(path)
+    return _font_coverage
+
+
+def _needs_glyph(ch: str) -> bool:
+    # whitespace rides along with the run it is in
+    return not ch.isspace()
+
+
+def _clusters(text: str) -> list[str]:
+    # a base character plus the combining marks that follow it
+    out: list[str] = []
+    for ch in text:
+        if out and unicodedata.combining(ch):
+            out[-1] += ch
+        else:
+            out.append(ch)
+    return out
+
+
 def pick_font(size: int = 72, text: str = None) -> str:
     fonts = list_fonts()
     if not fonts:
         # return None to indicate no external fonts available
         return None
-        
-    # Check if text contains Cyrillic characters
-    has_cyrillic = any(ord('а') <= ord(c) <= ord('я') or ord('А') <= ord(c) <= ord('Я') for c in text) if text else False
-    
-    # Filter fonts that support needed characters
-    suitable_fonts = []
-    for font_path in fonts:
-        try:
-            font = ImageFont.truetype(font_path, size=size)
-            # Test if font supports the first character of the text (as a basic check)
-            if text and text[0]:
-                if font.getmask(text[0]):
-                    suitable_fonts.append(font_path)
-            else:
-                suitable_fonts.append(font_path)
-        except Exception:
-            continue
-    
-    if suitable_fonts:
-        return random.choice(suitable_fonts)
+
+    index = coverage_index()
+    needed = frozenset(ord(c) for c in text if _needs_glyph(c)) if text else frozenset()
+    if not needed:
+        return random.choice(fonts)
+
+    # Prefer the fonts covering the most of the text
+    scores = {path: len(needed & index.get(path, frozenset())) for path in fonts}
+    best = max(scores.values())
+    if best:
+        return random.choice([path for path, score in scores.items() if score == best])
     return random.choice(fonts)  # Fallback to any font if no suitable ones found
 
 
-def measure_text(text: str, font: ImageFont.FreeTypeFont) -> Tuple[int,int]:
-    dummy = Image.new('RGBA', (1,1))
-    draw = ImageDraw.Draw(dummy)
-    return draw.textsize(text, font=font)
+def font_chain(text: str, primary: str | None) -> list[str]:
+    """Return `primary` followed by the fonts needed to cover the rest of `text`.
+
+    Fonts are picked greedily, each one covering the most of what is still
+    missing, until nothing more can be covered.
+    """
+    chain = [primary] if primary else []
+    index = coverage_index()
+    missing = {ord(c) for c in text if _needs_glyph(c)}
+    if primary:
+        missing -= index.get(primary, frozenset())
+    while missing:
+        best, best_hits = None, 0
+        for path, cov in index.items():
+            hits = len(missing & cov)
+            if hits > best_hits:
+                best, best_hits = path, hits
+        if best is None:
+            break
+        chain.append(best)
+        missing -= index[best]
+    return chain
 
 
-def render_text_image(text: str, font_path: str, size: int = 72, padding: int = 24) -> BytesIO:
+@lru_cache(maxsize=4096)
+def segment_runs(text: str, primary: str | None) -> tuple[tuple[str, str | None], ...]:
+    """Split `text` into (run_text, font_path) runs, one font per run.
+
+    Fonts are assigned per cluster (a base character and its combining marks):
+    the first font in font_chain() covering the whole cluster, else the first
+    one with the base character, else the primary font.
+    """
+    chain = font_chain(text, primary)
+    index = coverage_index()
+    runs: list[list] = []
+    for cluster in _clusters(text):
+        if runs and not any(_needs_glyph(c) for c in cluster):
+            runs[-1][0] += cluster
+            continue
+        cps = {ord(c) for c in cluster if _needs_glyph(c)}
+        font = next((path for path in chain if cps <= index.get(path, frozenset())), None)
+        if font is None:
+            base = ord(cluster[0])
+            font = next((path for path in chain if base in index.get(path, frozenset())), primary)
+        if runs and runs[-1][1] == font:
+            runs[-1][0] += cluster
+        else:
+            runs.append([cluster, font])
+    return tuple((run, font) for run, font in runs)
+
+
+@lru_cache(maxsize=256)
+def _load_font(font_path: str | None, size: int):
     if font_path:
         try:
-            font = ImageFont.truetype(font_path, size=size)
+            return ImageFont.truetype(font_path, size=size)
         except Exception:
             # fallback to default font if truetype fails
-            font = ImageFont.load_default()
-    else:
-        font = ImageFont.load_default()
-    w, h = measure_text(text, font)
-    img_w = w + padding * 2
-    img_h = h + padding * 2
+            pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has no sized default font
+        return ImageFont.load_default()
+
+
+def _metrics(font) -> Tuple[int, int]:
+    if hasattr(font, 'getmetrics'):
+        return font.getmetrics()
+    bbox = font.getbbox('Ag')
+    return bbox[3], 0
+
+
+def measure_text(text: str, font: ImageFont.FreeTypeFont) -> Tuple[int,int]:
+    dummy = Image.new('RGBA', (1,1))
+    draw = ImageDraw.Draw(dummy)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    return right - left, bottom - top
+
+
+def _glyph(font, font_path: str | None, size: int, cluster: str) -> tuple:
+    global _glyph_bytes
+    key = (font_path, size, cluster)
+    entry = _glyphs.get(key)
+    if entry is not None:
+        _glyphs.move_to_end(key)
+        return entry
+    left, top, right, bottom = font.getbbox(cluster)
+    mask = Image.new('L', (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(mask).text((-left, -top), cluster, font=font, fill=255)
+    entry = (mask, left, top, font.getlength(cluster))
+    _glyphs[key] = entry
+    _glyph_bytes += mask.width * mask.height
+    while _glyph_bytes > GLYPH_CACHE_BYTES and len(_glyphs) > 1:
+        _, (old, *_rest) = _glyphs.popitem(last=False)
+        _glyph_bytes -= old.width * old.height
+    return entry
+
+
+def glyph_cache_info() -> dict:
+    return {'glyphs': len(_glyphs), 'bytes': _glyph_bytes, 'budget': GLYPH_CACHE_BYTES}
+
+
+def render_text_image(text: str, font_path: str, size: int = 72, padding: int = 24,
+                      smooth_chance: float = 0.25, compress_level: int = 6) -> BytesIO:
+    # Lay the runs out on one shared baseline, glyph by glyph
+    placed = []  # (mask, x, run_ascent, top)
+    ascent = descent = 0
+    pen = 0.0
+    for run, path in segment_runs(text, font_path):
+        font = _load_font(path, size)
+        run_ascent, run_descent = _metrics(font)
+        ascent = max(ascent, run_ascent)
+        descent = max(descent, run_descent)
+        for cluster in _clusters(run):
+            mask, left, top, advance = _glyph(font, path, size, cluster)
+            placed.append((mask, int(round(pen)) + left, run_ascent, top))
+            pen += advance
+    if not placed:
+        ascent, descent = _metrics(_load_font(font_path, size))
+    img_w = int(round(pen)) + padding * 2
+    img_h = ascent + descent + padding * 2
+
+    # Composite the cached masks into one coverage mask for the whole text
+    text_mask = Image.new('L', (img_w, img_h), 0)
+    for mask, x, run_ascent, top in placed:
+        box = (padding + x, padding + ascent - run_ascent + top)
+        box = box + (box[0] + mask.width, box[1] + mask.height)
+        text_mask.paste(ImageChops.lighter(text_mask.crop(box), mask), box)
+
     img = Image.new('RGBA', (img_w, img_h), (255,255,255,0))
-    draw = ImageDraw.Draw(img)
 
-    # Draw shadow
+    # Draw shadow: the same mask, offset
     shadow_offset = max(2, size // 24)
     shadow_color = (0,0,0,160)
-    x = padding
-    y = padding
-    draw.text((x+shadow_offset, y+shadow_offset), text, font=font, fill=shadow_color)
+    img.paste(shadow_color, (shadow_offset, shadow_offset),
+              text_mask.crop((0, 0, img_w - shadow_offset, img_h - shadow_offset)))
 
     # Draw main text
-    draw.text((x, y), text, font=font, fill=(20,20,20,255))
+    img.paste((20,20,20,255), (0, 0), text_mask)
 
     # Random subtle filter
-    if random.random() < 0.25:
+    if random.random() < smooth_chance:
         img = img.filter(ImageFilter.SMOOTH)
 
     bio = BytesIO()
-    img.convert('RGBA').save(bio, 'PNG')
+    img.convert('RGBA').save(bio, 'PNG', compress_level=compress_level)
     bio.seek(0)
     return bio
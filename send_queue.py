@@ -0,0 +1,227 @@
+"""Outbound message scheduler that keeps the bot under Telegram's flood limits.
+
+Handlers submit a zero-argument coroutine factory (e.g.
+`lambda: update.message.reply_text('hi')`) for a chat. A single worker task
+sends queued jobs round-robin across chats while respecting:
+
+* a global rate (Telegram allows about 30 messages per second per bot),
+* a per-chat interval (about one message per second in the same chat),
+* `retry_after` from 429 responses, after which the job is retried.
+
+Jobs submitted with the same `coalesce_key` while one is still queued are
+merged: only the latest factory is sent and every waiter gets its result.
+That keeps fast pagination clicks from queueing one edit per click.
+
+The scheduler only calls the factories, so it can be driven by a fake Bot.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', '30'))
+CHAT_INTERVAL = float(os.environ.get('SEND_CHAT_INTERVAL', '1.0'))
+MAX_QUEUE = int(os.environ.get('SEND_QUEUE_MAX', '1000'))
+MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', '3'))
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    # telegram.error.RetryAfter carries retry_after as int seconds or a timedelta
+    value = getattr(exc, 'retry_after', None)
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class _Job:
+    __slots__ = ('chat_id', 'factory', 'key', 'futures', 'attempts')
+
+    def __init__(self, chat_id: Hashable, factory: Callable[[], Awaitable[Any]], key: Optional[Hashable]):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.key = key
+        self.futures: list[asyncio.Future] = []
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    def __init__(self, max_size: int = MAX_QUEUE, global_rate: float = GLOBAL_RATE,
+                 chat_interval: float = CHAT_INTERVAL, max_retries: int = MAX_RETRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.clock = clock
+        # chat_id -> queued jobs; dict order is the round-robin order
+        self._chats: OrderedDict[Hashable, deque[_Job]] = OrderedDict()
+        self._pending: Dict[Hashable, _Job] = {}
+        self._chat_ready_at: Dict[Hashable, float] = {}
+        self._global_ready_at = 0.0
+        self._depth = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        # set by close() so _send can tell the worker's own cancellation apart
+        self._closing = False
+        self.stats = {'sent': 0, 'failed': 0, 'coalesced': 0, 'retries': 0, 'throttled_seconds': 0.0}
+
+    def depth(self) -> int:
+        """Number of jobs waiting to be sent."""
+        return self._depth
+
+    def chat_depth(self, chat_id: Hashable) -> int:
+        return len(self._chats.get(chat_id, ()))
+
+    def metrics(self) -> dict:
+        return dict(self.stats, depth=self._depth, chats=len(self._chats))
+
+    def _ensure_worker(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_size)
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, chat_id: Hashable, factory: Callable[[], Awaitable[Any]],
+                     coalesce_key: Optional[Hashable] = None) -> Any:
+        """Queue `factory` for `chat_id` and return the result of the send.
+
+        Waits for a free slot when the queue is full.
+        """
+        self._ensure_worker()
+        fut = asyncio.get_running_loop().create_future()
+        job = self._pending.get(coalesce_key) if coalesce_key is not None else None
+        if job is not None:
+            # newer state replaces the queued one; both callers get its result
+            job.factory = factory
+            job.futures.append(fut)
+            self.stats['coalesced'] += 1
+            return await fut
+        await self._slots.acquire()
+        job = _Job(chat_id, factory, coalesce_key)
+        job.futures.append(fut)
+        self._enqueue(job)
+        return await fut
+
+    def _enqueue(self, job: _Job, front: bool = False):
+        queue = self._chats.setdefault(job.chat_id, deque())
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        if job.key is not None:
+            self._pending[job.key] = job
+        self._depth += 1
+        self._wakeup.set()
+
+    def _next_job(self) -> tuple[Optional[_Job], Optional[float]]:
+        """Return (job, None) for a sendable job, else (None, seconds until one is)."""
+        now = self.clock()
+        wait = None
+        for chat_id, queue in self._chats.items():
+            ready_at = max(self._chat_ready_at.get(chat_id, 0.0), self._global_ready_at)
+            if ready_at <= now:
+                job = queue.popleft()
+                if queue:
+                    self._chats.move_to_end(chat_id)
+                else:
+                    del self._chats[chat_id]
+                self._depth -= 1
+                if job.key is not None and self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+                return job, None
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            job, wait = self._next_job()
+            if job is None:
+                if wait is None:
+                    # idle: forget chats whose interval has already passed
+                    now = self.clock()
+                    self._chat_ready_at = {c: t for c, t in self._chat_ready_at.items() if t > now}
+                self._wakeup.clear()
+                started = self.clock()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                if wait is not None:
+                    self.stats['throttled_seconds'] += self.clock() - started
+                continue
+            await self._send(job)
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.factory()
+        except Exception as exc:
+            delay = _retry_after(exc)
+            now = self.clock()
+            if delay is not None and job.attempts < self.max_retries:
+                job.attempts += 1
+                self.stats['retries'] += 1
+                # flood control is bot-wide, so hold everything back
+                self._global_ready_at = max(self._global_ready_at, now + delay)
+                self._chat_ready_at[job.chat_id] = max(self._chat_ready_at.get(job.chat_id, 0.0), now + delay)
+                newer = self._pending.get(job.key) if job.key is not None else None
+                if newer is not None:
+                    # a newer state was queued meanwhile; let it answer our waiters
+                    newer.futures.extend(job.futures)
+                    self._slots.release()
+                else:
+                    self._enqueue(job, front=True)
+                return
+            self.stats['failed'] += 1
+            self._finish(job, exc=exc)
+        except BaseException as exc:
+            # CancelledError and friends: never leave callers waiting or a slot taken
+            self.stats['failed'] += 1
+            self._finish(job, exc=exc)
+            if not isinstance(exc, asyncio.CancelledError) or self._worker_cancelled():
+                raise
+        else:
+            self.stats['sent'] += 1
+            self._finish(job, result=result)
+        now = self.clock()
+        self._chat_ready_at[job.chat_id] = now + self.chat_interval
+        self._global_ready_at = max(self._global_ready_at, now + self.global_interval)
+
+    def _worker_cancelled(self) -> bool:
+        if self._closing:
+            return True
+        # Task.cancelling() is 3.11+; older interpreters only see close()
+        task = asyncio.current_task()
+        cancelling = getattr(task, 'cancelling', None)
+        return bool(cancelling and cancelling())
+
+    def _finish(self, job: _Job, result: Any = None, exc: Optional[BaseException] = None):
+        self._slots.release()
+        for fut in job.futures:
+            if fut.done():
+                continue
+            if isinstance(exc, asyncio.CancelledError):
+                fut.cancel()
+            elif exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+    async def close(self):
+        if self._worker is not None:
+            self._closing = True
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._closing = False
+            self._worker = None
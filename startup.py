@@ -0,0 +1,63 @@
+"""Startup time breakdown for the bot process.
+
+bot.py wraps each startup phase in `phase(name)`; `report()` formats the
+timings against COLD_START_TARGET_MS.
+
+Usage:
+    python startup.py   # import the bot, print the breakdown, exit 1 if over target
+"""
+from __future__ import annotations
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+_STARTED = time.perf_counter()
+
+# phase name -> milliseconds, in the order the phases ran
+TIMINGS: dict[str, float] = {}
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS[name] = TIMINGS.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def total_ms() -> float:
+    """Milliseconds since this module was imported."""
+    return (time.perf_counter() - _STARTED) * 1000
+
+
+def target_ms() -> float:
+    # read lazily: this module is imported before bot.py loads .env
+    return float(os.environ.get('COLD_START_TARGET_MS', '400'))
+
+
+def within_target() -> bool:
+    return total_ms() <= target_ms()
+
+
+def report() -> str:
+    lines = ['Startup time:']
+    for name, ms in TIMINGS.items():
+        lines.append(f'  {name:<14}{ms:8.1f} ms')
+    status = 'ok' if within_target() else 'OVER TARGET'
+    lines.append(f'  {"total":<14}{total_ms():8.1f} ms (target {target_ms():.0f} ms, {status})')
+    return '\n'.join(lines)
+
+
+def main():
+    import bot  # noqa: F401
+    # run as a script this file is __main__; bot.py recorded into `startup`
+    import startup
+    print(startup.report())
+    sys.exit(0 if startup.within_target() else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Persistent text_key -> text map for pagination.
+
+Callback tokens only carry the text key, so a page click after a restart needs
+the original text back. Every paginated text is written here once per process;
+rows not seen for TEXT_STORE_DAYS are pruned when the store is opened.
+"""
+from __future__ import annotations
+import os
+import sqlite3
+import time
+from typing import Optional
+
+
+TEXT_STORE_PATH = os.environ.get('TEXT_STORE_PATH', 'texts.sqlite')
+TEXT_STORE_DAYS = float(os.environ.get('TEXT_STORE_DAYS', '30'))
+
+
+def sqlite_key(key: int) -> int:
+    # text keys are unsigned 64-bit, sqlite integers are signed
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class TextStore:
+    def __init__(self, conn: Optional[sqlite3.Connection] = None):
+        self._conn = conn
+
+    def get(self, key: int) -> Optional[str]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute('SELECT text FROM texts WHERE key = ?', (sqlite_key(key),)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def put(self, key: int, text: str):
+        if self._conn is None:
+            return
+        try:
+            with self._conn:
+                self._conn.execute('INSERT OR REPLACE INTO texts VALUES (?, ?, ?)',
+                                   (sqlite_key(key), text, int(time.time())))
+        except sqlite3.Error as exc:
+            print(f'Could not save text: {exc}')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def open_store(path: str = TEXT_STORE_PATH) -> TextStore:
+    """Open (or create) the store at `path`. On errors pagination stays in-memory only."""
+    try:
+        conn = sqlite3.connect(path)
+        # WAL keeps the per-text commits cheap
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS texts '
+                     '(key INTEGER PRIMARY KEY, text TEXT NOT NULL, seen INTEGER NOT NULL)')
+        with conn:
+            conn.execute('DELETE FROM texts WHERE seen < ?', (int(time.time() - TEXT_STORE_DAYS * 86400),))
+    except sqlite3.Error as exc:
+        print(f'Text store {path} unavailable, pages will not survive a restart: {exc}')
+        return TextStore()
+    return TextStore(conn)
@@ -5,16 +5,30 @@ when available. Unmappable characters are left unchanged.
 """
 from __future__ import annotations
 from typing import Dict
+import hashlib
+import os
 import random
-
-try:
-    import pyfiglet
-except Exception:
-    pyfiglet = None
+import unicodedata
 
 
 _styles: Dict[str, Dict[int, str]] = {}
 
+# Per-style coverage, filled by _build_coverage():
+# style -> codepoints mapped to a real styled glyph
+_coverage: Dict[str, frozenset[int]] = {}
+# style -> codepoints only decorated with combining marks (e.g. 'б' -> 'б̀')
+_mark_coverage: Dict[str, frozenset[int]] = {}
+
+# Styles covering less than this share of the input's letters are skipped
+MIN_STYLE_COVERAGE = float(os.environ.get('MIN_STYLE_COVERAGE', '0.4'))
+
+# Combining-mark decorations render as tofu on many clients, so they count
+# for less than a real glyph when scoring coverage.
+MARK_COVERAGE_WEIGHT = 0.5
+
+# pyfiglet is imported on first use; False means the import failed
+_pyfiglet = None
+
 
 def _build_offset_style(name: str, base_ord: int, digits_base: int | None = None):
     # builds a mapping for A-Z and a-z using offsets where available
@@ -38,47 +52,49 @@ def _map_from_pairs(name: str, pairs: Dict[str, str]):
     _styles[name] = table
 
 
+# Per-letter variants for the russian_style_* maps; style N uses index N-1
+_RUSSIAN_CHARS = {
+    'а': ['𝒂', '𝓪', '𝔞', '𝕒', '𝖆', '𝗮', '𝘢', '𝙖'],
+    'б': ['б', 'б̀', 'б̂', 'б̃', 'б̄', 'б̅', 'б̈', 'б̋'],
+    'в': ['в', 'в̀', 'в̂', 'в̃', 'в̄', 'в̅', 'в̈', 'в̋'],
+    'г': ['г', 'г̀', 'г̂', 'г̃', 'г̄', 'г̅', 'г̈', 'г̋', 'г̌'],
+    'д': ['д', 'д̀', 'д̂', 'д̃', 'д̄', 'д̅', 'д̈', 'д̋', 'д̌'],
+    'е': ['𝒆', '𝓮', '𝔢', '𝕖', '𝖊', '𝗲', '𝘦', '𝙚', '𝚎'],
+    'ё': ['ё', 'ё̀', 'ё̂', 'ё̃', 'ё̄', 'ё̅', 'ё̈', 'ё̋', 'ё̌'],
+    'ж': ['ж', 'ж̀', 'ж̂', 'ж̃', 'ж̄', 'ж̅', 'ӝ', 'ж̋', 'ж̌'],
+    'з': ['з', 'з̀', 'з̂', 'з̃', 'з̄', 'з̅', 'ӟ', 'з̋', 'з̌'],
+    'и': ['и', 'ѝ', 'и̂', 'и̃', 'ӣ', 'и̅', 'ӥ', 'и̋', 'и̌'],
+    'й': ['й', 'й̀', 'й̂', 'й̃', 'й̄', 'й̅', 'й̈', 'й̋', 'й̌'],
+    'к': ['к', 'к̀', 'к̂', 'к̃', 'к̄', 'к̅', 'к̈', 'к̋', 'к̌'],
+    'л': ['л', 'л̀', 'л̂', 'л̃', 'л̄', 'л̅', 'л̈', 'л̋', 'л̌'],
+    'м': ['м', 'м̀', 'м̂', 'м̃', 'м̄', 'м̅', 'м̈', 'м̋', 'м̌'],
+    'н': ['н', 'н̀', 'н̂', 'н̃', 'н̄', 'н̅', 'н̈', 'н̋', 'н̌'],
+    'о': ['𝒐', '𝓸', '𝔬', '𝕠', '𝖔', '𝗼', '𝘰', '𝙤', '𝚘'],
+    'п': ['п', 'п̀', 'п̂', 'п̃', 'п̄', 'п̅', 'п̈', 'п̋', 'п̌'],
+    'р': ['р', 'р̀', 'р̂', 'р̃', 'р̄', 'р̅', 'р̈', 'р̋', 'р̌'],
+    'с': ['с', 'с̀', 'с̂', 'с̃', 'с̄', 'с̅', 'с̈', 'с̋', 'с̌'],
+    'т': ['т', 'т̀', 'т̂', 'т̃', 'т̄', 'т̅', 'т̈', 'т̋', 'т̌'],
+    'у': ['у', 'у̀', 'у̂', 'у̃', 'ӯ', 'у̅', 'ӱ', 'ӳ', 'у̌'],
+    'ф': ['ф', 'ф̀', 'ф̂', 'ф̃', 'ф̄', 'ф̅', 'ф̈', 'ф̋', 'ф̌'],
+    'х': ['х', 'х̀', 'х̂', 'х̃', 'х̄', 'х̅', 'х̈', 'х̋', 'х̌'],
+    'ц': ['ц', 'ц̀', 'ц̂', 'ц̃', 'ц̄', 'ц̅', 'ц̈', 'ц̋', 'ц̌'],
+    'ч': ['ч', 'ч̀', 'ч̂', 'ч̃', 'ч̄', 'ч̅', 'ӵ', 'ч̋', 'ч̌'],
+    'ш': ['ш', 'ш̀', 'ш̂', 'ш̃', 'ш̄', 'ш̅', 'ш̈', 'ш̋', 'ш̌'],
+    'щ': ['щ', 'щ̀', 'щ̂', 'щ̃', 'щ̄', 'щ̅', 'щ̈', 'щ̋', 'щ̌'],
+    'ъ': ['ъ', 'ъ̀', 'ъ̂', 'ъ̃', 'ъ̄', 'ъ̅', 'ъ̈', 'ъ̋', 'ъ̌'],
+    'ы': ['ы', 'ы̀', 'ы̂', 'ы̃', 'ы̄', 'ы̅', 'ӹ', 'ы̋', 'ы̌'],
+    'ь': ['ь', 'ь̀', 'ь̂', 'ь̃', 'ь̄', 'ь̅', 'ь̈', 'ь̋', 'ь̌'],
+    'э': ['э', 'э̀', 'э̂', 'э̃', 'э̄', 'э̅', 'ӭ', 'э̋', 'э̌'],
+    'ю': ['ю', 'ю̀', 'ю̂', 'ю̃', 'ю̄', 'ю̅', 'ю̈', 'ю̋', 'ю̌'],
+    'я': ['я', 'я̀', 'я̂', 'я̃', 'я̄', 'я̅', 'я̈', 'я̋', 'я̌']
+}
+
+
 def init_styles():
     # Create multiple Russian style maps
     for style_index in range(8):  # Create 8 different Russian style maps
         russian_stylish_map = {}
-        russian_chars = {
-            'а': ['𝒂', '𝓪', '𝔞', '𝕒', '𝖆', '𝗮', '𝘢', '𝙖'],
-            'б': ['б', 'б̀', 'б̂', 'б̃', 'б̄', 'б̅', 'б̈', 'б̋'],
-            'в': ['в', 'в̀', 'в̂', 'в̃', 'в̄', 'в̅', 'в̈', 'в̋'],
-        'г': ['г', 'г̀', 'г̂', 'г̃', 'г̄', 'г̅', 'г̈', 'г̋', 'г̌'],
-        'д': ['д', 'д̀', 'д̂', 'д̃', 'д̄', 'д̅', 'д̈', 'д̋', 'д̌'],
-        'е': ['𝒆', '𝓮', '𝔢', '𝕖', '𝖊', '𝗲', '𝘦', '𝙚', '𝚎'],
-        'ё': ['ё', 'ё̀', 'ё̂', 'ё̃', 'ё̄', 'ё̅', 'ё̈', 'ё̋', 'ё̌'],
-        'ж': ['ж', 'ж̀', 'ж̂', 'ж̃', 'ж̄', 'ж̅', 'ӝ', 'ж̋', 'ж̌'],
-        'з': ['з', 'з̀', 'з̂', 'з̃', 'з̄', 'з̅', 'ӟ', 'з̋', 'з̌'],
-        'и': ['и', 'ѝ', 'и̂', 'и̃', 'ӣ', 'и̅', 'ӥ', 'и̋', 'и̌'],
-        'й': ['й', 'й̀', 'й̂', 'й̃', 'й̄', 'й̅', 'й̈', 'й̋', 'й̌'],
-        'к': ['к', 'к̀', 'к̂', 'к̃', 'к̄', 'к̅', 'к̈', 'к̋', 'к̌'],
-        'л': ['л', 'л̀', 'л̂', 'л̃', 'л̄', 'л̅', 'л̈', 'л̋', 'л̌'],
-        'м': ['м', 'м̀', 'м̂', 'м̃', 'м̄', 'м̅', 'м̈', 'м̋', 'м̌'],
-        'н': ['н', 'н̀', 'н̂', 'н̃', 'н̄', 'н̅', 'н̈', 'н̋', 'н̌'],
-        'о': ['𝒐', '𝓸', '𝔬', '𝕠', '𝖔', '𝗼', '𝘰', '𝙤', '𝚘'],
-        'п': ['п', 'п̀', 'п̂', 'п̃', 'п̄', 'п̅', 'п̈', 'п̋', 'п̌'],
-        'р': ['р', 'р̀', 'р̂', 'р̃', 'р̄', 'р̅', 'р̈', 'р̋', 'р̌'],
-        'с': ['с', 'с̀', 'с̂', 'с̃', 'с̄', 'с̅', 'с̈', 'с̋', 'с̌'],
-        'т': ['т', 'т̀', 'т̂', 'т̃', 'т̄', 'т̅', 'т̈', 'т̋', 'т̌'],
-        'у': ['у', 'у̀', 'у̂', 'у̃', 'ӯ', 'у̅', 'ӱ', 'ӳ', 'у̌'],
-        'ф': ['ф', 'ф̀', 'ф̂', 'ф̃', 'ф̄', 'ф̅', 'ф̈', 'ф̋', 'ф̌'],
-        'х': ['х', 'х̀', 'х̂', 'х̃', 'х̄', 'х̅', 'х̈', 'х̋', 'х̌'],
-        'ц': ['ц', 'ц̀', 'ц̂', 'ц̃', 'ц̄', 'ц̅', 'ц̈', 'ц̋', 'ц̌'],
-        'ч': ['ч', 'ч̀', 'ч̂', 'ч̃', 'ч̄', 'ч̅', 'ӵ', 'ч̋', 'ч̌'],
-        'ш': ['ш', 'ш̀', 'ш̂', 'ш̃', 'ш̄', 'ш̅', 'ш̈', 'ш̋', 'ш̌'],
-        'щ': ['щ', 'щ̀', 'щ̂', 'щ̃', 'щ̄', 'щ̅', 'щ̈', 'щ̋', 'щ̌'],
-        'ъ': ['ъ', 'ъ̀', 'ъ̂', 'ъ̃', 'ъ̄', 'ъ̅', 'ъ̈', 'ъ̋', 'ъ̌'],
-        'ы': ['ы', 'ы̀', 'ы̂', 'ы̃', 'ы̄', 'ы̅', 'ӹ', 'ы̋', 'ы̌'],
-        'ь': ['ь', 'ь̀', 'ь̂', 'ь̃', 'ь̄', 'ь̅', 'ь̈', 'ь̋', 'ь̌'],
-        'э': ['э', 'э̀', 'э̂', 'э̃', 'э̄', 'э̅', 'ӭ', 'э̋', 'э̌'],
-        'ю': ['ю', 'ю̀', 'ю̂', 'ю̃', 'ю̄', 'ю̅', 'ю̈', 'ю̋', 'ю̌'],
-        'я': ['я', 'я̀', 'я̂', 'я̃', 'я̄', 'я̅', 'я̈', 'я̋', 'я̌']
-    }
-    
-        for char, variants in russian_chars.items():
+        for char, variants in _RUSSIAN_CHARS.items():
             if style_index < len(variants):
                 variant = variants[style_index]
                 russian_stylish_map[ord(char)] = variant
@@ -221,6 +237,29 @@ def init_styles():
         strike_map[ord(c)] = c + '̶'  # Combining strike through
     _styles['strike'] = strike_map
 
+    _build_coverage()
+
+
+def _build_coverage():
+    _coverage.clear()
+    _mark_coverage.clear()
+    for name, table in _styles.items():
+        glyphs = set()
+        marks = set()
+        for cp, out in table.items():
+            ch = chr(cp)
+            if out == ch:
+                continue
+            composed = unicodedata.normalize('NFC', out)
+            if len(composed) == 1:
+                glyphs.add(cp)
+            elif composed[0] == ch and all(unicodedata.combining(m) for m in composed[1:]):
+                marks.add(cp)
+            else:
+                glyphs.add(cp)
+        _coverage[name] = frozenset(glyphs)
+        _mark_coverage[name] = frozenset(marks)
+
 
 init_styles()
 
@@ -229,6 +268,65 @@ def available_styles() -> list[str]:
     return sorted(_styles.keys())
 
 
+def styles_fingerprint() -> str:
+    """Return a short hash of the built style tables.
+
+    Anything persisted from transform()/generate_variants output should be
+    stamped with this so it is invalidated when the tables change.
+    """
+    h = hashlib.sha256()
+    for name in sorted(_styles):
+        h.update(name.encode('utf-8'))
+        for cp, out in sorted(_styles[name].items()):
+            h.update(f'{cp}:{out};'.encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def style_coverage(chars: frozenset[int], style: str) -> float:
+    """Share of the letters/digits in `chars` that `style` actually styles.
+
+    `chars` is a set of codepoints (see _letter_codepoints); cost is
+    O(len(chars)) per style.
+    """
+    if not chars:
+        return 0.0
+    glyphs = len(chars & _coverage[style])
+    marks = len(chars & _mark_coverage[style])
+    return (glyphs + MARK_COVERAGE_WEIGHT * marks) / len(chars)
+
+
+def _letter_codepoints(text: str) -> frozenset[int]:
+    return frozenset(ord(c) for c in set(text) if c.isalnum())
+
+
+def _script_groups(text: str) -> list[frozenset[int]]:
+    """Letters/digits of `text` grouped by script ('LATIN', 'CYRILLIC', ...).
+
+    Digits only form a group of their own when the text has no letters.
+    """
+    groups: Dict[str, set[int]] = {}
+    for cp in _letter_codepoints(text):
+        # the first word of the character name is its script, e.g. 'CYRILLIC SMALL LETTER A'
+        script = unicodedata.name(chr(cp), '').split(' ', 1)[0]
+        groups.setdefault(script, set()).add(cp)
+    if len(groups) > 1:
+        groups.pop('DIGIT', None)
+    return [frozenset(g) for g in groups.values()]
+
+
+def rank_styles(text: str, min_coverage: float = MIN_STYLE_COVERAGE) -> list[str]:
+    """Return styles covering at least `min_coverage` of `text`, best first.
+
+    A style is scored by its worst-covered script, so on mixed-script text a
+    style that leaves one script unstyled is skipped rather than ranked.
+    """
+    groups = _script_groups(text)
+    if not groups:
+        return []
+    scored = [(min(style_coverage(g, s) for g in groups), s) for s in available_styles()]
+    return [s for score, s in sorted(scored, key=lambda x: -x[0]) if score >= min_coverage and score > 0]
+
+
 def transform(text: str, style: str) -> str:
     if style not in _styles:
         raise KeyError(f'Unknown style: {style}')
@@ -236,17 +334,28 @@ def transform(text: str, style: str) -> str:
     return text.translate(table)
 
 
-def _apply_combining(text: str, intensity: int = 1) -> str:
+def _figlet():
+    global _pyfiglet
+    if _pyfiglet is None:
+        try:
+            import pyfiglet
+            _pyfiglet = pyfiglet
+        except Exception:
+            _pyfiglet = False
+    return _pyfiglet or None
+
+
+def _apply_combining(text: str, intensity: int = 1, rng=random) -> str:
     # add some combining diacritics above/below characters to create messy unique looks
     comb_above = [0x0300, 0x0301, 0x0302, 0x0303, 0x0308, 0x030A]
     comb_below = [0x0323, 0x0324, 0x0325]
     out = []
     for ch in text:
         out.append(ch)
-        if ch.strip() and random.random() < 0.25 * intensity:
-            out.append(chr(random.choice(comb_above)))
-        if ch.strip() and random.random() < 0.15 * intensity:
-            out.append(chr(random.choice(comb_below)))
+        if ch.strip() and rng.random() < 0.25 * intensity:
+            out.append(chr(rng.choice(comb_above)))
+        if ch.strip() and rng.random() < 0.15 * intensity:
+            out.append(chr(rng.choice(comb_below)))
     return ''.join(out)
 
 
@@ -255,46 +364,37 @@ def _leet(text: str) -> str:
     return ''.join(m.get(c, c) for c in text)
 
 
-def generate_variants(text: str, max_variants: int = 40) -> list[str]:
+def generate_variants(text: str, max_variants: int = 40, seed: int | None = None, figlet: bool = True) -> list[str]:
     """Return a list of textual 'font' variants for the given text.
 
     Generates exactly max_variants unique variations using various transformations.
-    For Russian text, includes additional Cyrillic-specific transformations.
+    With a `seed` the result is reproducible, so a page can be rebuilt later
+    from the seed alone. `figlet=False` skips the (slow) ASCII art variants.
+    Only styles whose tables cover enough of every script in the text are
+    applied, best covered first, so Cyrillic text gets the russian_style_*
+    maps rather than Latin-only ones that would leave it unchanged.
     """
-    # Detect if text contains Russian characters
-    has_cyrillic = any(ord('а') <= ord(c) <= ord('я') or ord('А') <= ord(c) <= ord('Я') for c in text)
-    
-    variants = set()  # Use set to ensure uniqueness
-    
-    # Get all available styles
-    all_styles = available_styles()
-    
-    # Organize styles based on text content
-    if has_cyrillic:
-        # Put Russian styles first for Cyrillic text
-        russian_styles = [s for s in all_styles if s.startswith('russian_style_')]
-        other_styles = [s for s in all_styles if not s.startswith('russian_style_')]
-        styles_to_try = russian_styles + other_styles
-    else:
-        styles_to_try = all_styles
-    
+    rng = random.Random(seed) if seed is not None else random
+    variants = {}  # dict keeps insertion order, so the best styles come first
+
     # Apply style transforms
-    for style in styles_to_try:
+    for style in rank_styles(text):
         try:
             variant = transform(text, style)
             if variant != text:  # Only add if the transform actually changed something
-                variants.add(variant)
+                variants[variant] = None
         except Exception:
             continue
-            
+
     # Add combining diacritics variants
     for intensity in range(1, 4):
-        variants.add(_apply_combining(text, intensity=intensity))
-        
+        variants[_apply_combining(text, intensity=intensity, rng=rng)] = None
+
     # Add leet speak variant
-    variants.add(_leet(text))
+    variants[_leet(text)] = None
 
     # Add ASCII art variants if pyfiglet is available
+    pyfiglet = _figlet() if figlet else None
     if pyfiglet:
         # Carefully selected fonts that work well with both Latin and Cyrillic
         fonts = [
@@ -306,14 +406,14 @@ def generate_variants(text: str, max_variants: int = 40) -> list[str]:
             try:
                 art = pyfiglet.figlet_format(text, font=f)
                 if art and art.strip():  # Only add if we got valid output
-                    variants.add(art)
+                    variants[art] = None
             except Exception:
                 continue
 
     # Add original text if not already included
-    variants.add(text)
-    
-    # Convert set to list and ensure we have exactly max_variants
+    variants[text] = None
+
+    # Convert to list and ensure we have exactly max_variants
     result = list(variants)
     
     # If we don't have enough variants, add more using combining characters
@@ -321,10 +421,10 @@ def generate_variants(text: str, max_variants: int = 40) -> list[str]:
         # Create new variants using different combining character patterns
         new_variant = text
         for c in new_variant:
-            if random.random() < 0.5:
+            if rng.random() < 0.5:
                 # Add random combining diacritical marks
                 marks = [chr(x) for x in range(0x0300, 0x0370)]
-                new_variant = new_variant.replace(c, c + random.choice(marks))
+                new_variant = new_variant.replace(c, c + rng.choice(marks))
         result.append(new_variant)
     
     # If we have too many variants, trim to max_variants
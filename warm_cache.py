@@ -0,0 +1,152 @@
+"""Precomputed variants for the most frequently requested texts.
+
+Offline, `build` reads an anonymized request log (one requested text per line),
+normalizes each line the way the bot does, takes the top-K texts and stores
+their `generate_variants` output and every `transform` style into a small
+sqlite file. The bot opens that file at startup
+and serves hits with a primary-key lookup, without computing anything.
+
+The store is stamped with FORMAT_VERSION and the style tables fingerprint; a
+store built against different tables is ignored at load time.
+
+Usage:
+    python warm_cache.py requests.log -k 5000 -o warm_cache.sqlite
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sqlite3
+from collections import Counter
+from typing import Iterable, Optional
+from text_transforms import available_styles, generate_variants, styles_fingerprint, transform
+from normalize import normalize_text, text_key
+from text_store import sqlite_key
+
+
+FORMAT_VERSION = 3
+
+WARM_CACHE_PATH = os.environ.get('WARM_CACHE_PATH', 'warm_cache.sqlite')
+
+# number of variants stored per text; matches what text_handler asks for
+MAX_VARIANTS = 40
+
+
+def _store_version() -> str:
+    return f'{FORMAT_VERSION}:{styles_fingerprint()}'
+
+
+def top_texts(lines: Iterable[str], k: int) -> list[str]:
+    counts = Counter(normalize_text(line) for line in lines)
+    counts.pop('', None)
+    return [text for text, _ in counts.most_common(k)]
+
+
+def build(log_path: str, output: str, k: int = 5000) -> int:
+    """Build the store at `output` from the log at `log_path`. Returns entry count."""
+    from tqdm import tqdm  # only the offline job needs it
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        texts = top_texts(f, k)
+    styles = available_styles()
+    tmp = output + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute('CREATE TABLE entries (text TEXT PRIMARY KEY, key INTEGER NOT NULL, '
+                     'variants TEXT NOT NULL, styled TEXT NOT NULL)')
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('version', _store_version()))
+        rows = []
+        for text in tqdm(texts, desc='Precomputing'):
+            # same seed the bot uses, so pages match a cache miss after a rebuild
+            key = text_key(text)
+            variants = generate_variants(text, max_variants=MAX_VARIANTS, seed=key)
+            styled = {s: transform(text, s) for s in styles}
+            rows.append((text, sqlite_key(key), json.dumps(variants, ensure_ascii=False),
+                         json.dumps(styled, ensure_ascii=False)))
+        conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)', rows)
+        # page tokens carry only the key; lets a restarted bot map them back to texts
+        conn.execute('CREATE INDEX entries_key ON entries (key)')
+        conn.commit()
+    finally:
+        conn.close()
+    # swap in atomically so a running bot never sees a half-written store
+    os.replace(tmp, output)
+    return len(texts)
+
+
+class WarmCache:
+    """Read-only view of a built store.
+
+    Rows are looked up by primary key on demand and only decoded on a hit,
+    so opening even a large store costs one version check.
+    """
+
+    def __init__(self, conn: Optional[sqlite3.Connection] = None):
+        self._conn = conn
+
+    def _row(self, column: str, text: str) -> Optional[str]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute(f'SELECT {column} FROM entries WHERE text = ?', (text,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def text_for_key(self, key: int) -> Optional[str]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute('SELECT text FROM entries WHERE key = ?', (sqlite_key(key),)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def variants(self, text: str) -> Optional[list[str]]:
+        raw = self._row('variants', text)
+        return json.loads(raw) if raw else None
+
+    def styled(self, text: str, style: str) -> Optional[str]:
+        raw = self._row('styled', text)
+        return json.loads(raw).get(style) if raw else None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def load(path: str = WARM_CACHE_PATH) -> WarmCache:
+    """Open the store at `path`. Missing or stale stores give an empty cache."""
+    if not os.path.isfile(path):
+        return WarmCache()
+    try:
+        # handlers and worker threads may both read it
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    except sqlite3.Error:
+        return WarmCache()
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.Error:
+        row = None
+    if not row or row[0] != _store_version():
+        print(f'Warm cache {path} is stale, ignoring it')
+        conn.close()
+        return WarmCache()
+    return WarmCache(conn)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('log', help='anonymized log, one requested text per line')
+    ap.add_argument('--top', '-k', type=int, default=5000, help='number of most frequent texts to precompute')
+    ap.add_argument('--output', '-o', default=WARM_CACHE_PATH, help='store file to write')
+    args = ap.parse_args()
+    n = build(args.log, args.output, args.top)
+    print(f'Done. {n} texts written to:', args.output)
+
+
+if __name__ == '__main__':
+    main()